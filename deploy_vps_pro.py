@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import os
+import re
+import shlex
 import subprocess
 import time
 import argparse
@@ -57,16 +59,205 @@ def restore_file(path, content):
         f.write(content.strip())
     print(f"Restored file: {path}")
 
+def detect_docker_compose():
+    try:
+        subprocess.check_call("docker-compose --version", shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return "docker-compose"
+    except:
+        try:
+            subprocess.check_call("docker compose version", shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            return "docker compose"
+        except:
+            print("Error: neither 'docker-compose' nor 'docker compose' found. Please install Docker and Docker Compose.")
+            exit(1)
+
+# Compose service the migrations run against; includes/config.php must point
+# the game at this service, otherwise we would migrate a different database.
+DB_SERVICE = 'db'
+
+class MigrationError(Exception):
+    pass
+
+def read_db_config(project_dir):
+    config_path = os.path.join(project_dir, 'includes', 'config.php')
+    if not os.path.exists(config_path):
+        return None
+
+    with open(config_path, 'r') as f:
+        content = f.read()
+
+    # PHP single-quoted strings only know the \' and \\ escapes.
+    config = {}
+    for key, value in re.findall(r"\$database\['(\w+)'\]\s*=\s*'((?:[^'\\]|\\.)*)';", content):
+        config[key] = re.sub(r"\\(['\\])", r"\1", value)
+
+    missing = {'host', 'user', 'userpw', 'databasename', 'tableprefix'} - config.keys()
+    if missing:
+        raise MigrationError(f"Could not read {', '.join(sorted(missing))} from {config_path}.")
+    return config
+
+def read_required_db_version(project_dir):
+    dbtables_path = os.path.join(project_dir, 'includes', 'dbtables.php')
+    with open(dbtables_path, 'r') as f:
+        match = re.search(r"define\('DB_VERSION_REQUIRED',\s*(\d+)\);", f.read())
+    if match is None:
+        raise MigrationError(f"DB_VERSION_REQUIRED is not defined in {dbtables_path}.")
+    return int(match.group(1))
+
+def list_migrations(project_dir):
+    # Same naming rule as install/index.php: migration_<revision>.sql
+    migrations_dir = os.path.join(project_dir, 'install', 'migrations')
+    migrations = []
+    for file_name in os.listdir(migrations_dir):
+        match = re.match(r'^migration_(\d+)\.sql$', file_name)
+        if match:
+            migrations.append((int(match.group(1)), os.path.join(migrations_dir, file_name)))
+    return sorted(migrations)
+
+def split_statements(sql, prefix):
+    # Split like the web upgrader does (";\n"), tolerating a missing final newline.
+    sql = sql.replace('%PREFIX%', prefix).replace('\r\n', '\n')
+    statements = [s.strip() for s in re.split(r';[ \t]*\n', sql + '\n')]
+    return [s.rstrip(';').strip() for s in statements if s.strip()]
+
+def build_migration_script(statements, revision, prefix):
+    # The version bump goes last, so the mysql client (which stops at the
+    # first failing statement unless --force is used) only records it when
+    # everything else worked.
+    # No transaction: the game tables are MyISAM and migrations are mostly
+    # DDL, so a failed migration can not be rolled back anyway.
+    statements = statements + [f"UPDATE `{prefix}system` SET dbVersion = {revision}"]
+    return ";\n".join(statements) + ";\n"
+
+def mysql_exec(docker_cmd, project_dir, db_config, sql, batch=False, force=False, tcp=False):
+    # Feeds the given SQL to the mysql client of the db container with a
+    # single `docker exec`. The client still sends every statement as its own
+    # query, so this saves process spawns, not server round trips.
+    # The password is forwarded from our environment, so it never shows up on
+    # a command line.
+    command = (f"{docker_cmd} exec -T -e MYSQL_PWD {DB_SERVICE} "
+               f"mysql --user={shlex.quote(db_config['user'])} {shlex.quote(db_config['databasename'])}")
+    if batch:
+        command += " --batch --skip-column-names"
+    if force:
+        command += " --force"
+    if tcp:
+        command += " --protocol=tcp --host=127.0.0.1"
+    env = {**os.environ, 'MYSQL_PWD': db_config['userpw']}
+    return subprocess.run(command, shell=True, cwd=project_dir, env=env, input=sql,
+                          capture_output=True, text=True)
+
+def wait_for_database(docker_cmd, project_dir, db_config, timeout=120):
+    # Probe over TCP: while the mysql image initialises a fresh volume it runs
+    # a temporary server on the socket only, which shuts down again shortly.
+    deadline = time.monotonic() + timeout
+    while True:
+        result = mysql_exec(docker_cmd, project_dir, db_config, "SELECT 1;", batch=True, tcp=True)
+        if result.returncode == 0:
+            return
+        # Access denied / unknown database will not go away by waiting.
+        if 'ERROR 1045' in result.stderr or 'ERROR 1049' in result.stderr:
+            raise MigrationError(f"Can not connect to the database:\n{result.stderr.strip()}")
+        if time.monotonic() >= deadline:
+            raise MigrationError(f"Database did not become available within {timeout}s:\n{result.stderr.strip()}")
+        print("Waiting for database...")
+        time.sleep(3)
+
+def get_db_version(docker_cmd, project_dir, db_config):
+    table = f"{db_config['tableprefix']}system"
+    result = mysql_exec(docker_cmd, project_dir, db_config, f"SELECT dbVersion FROM `{table}`;", batch=True)
+    if result.returncode != 0:
+        # Like install/index.php: no system table means nothing was migrated yet.
+        if 'ERROR 1146' in result.stderr:
+            return 0
+        raise MigrationError(f"Could not read dbVersion from {table}:\n{result.stderr.strip()}")
+
+    rows = result.stdout.split()
+    if len(rows) != 1:
+        raise MigrationError(f"Expected exactly one row in {table}, found {len(rows)}; fix the table before migrating.")
+    return int(rows[0])
+
+def run_migrations(docker_cmd, project_dir, db_config, dry_run=False, force=False):
+    prefix = db_config['tableprefix']
+    required_version = read_required_db_version(project_dir)
+    db_version = get_db_version(docker_cmd, project_dir, db_config)
+
+    pending = [(revision, path) for revision, path in list_migrations(project_dir)
+               if db_version < revision <= required_version]
+    print(f"Database version: {db_version}, required: {required_version}, pending migrations: {len(pending)}")
+
+    total_start = time.monotonic()
+    for revision, path in pending:
+        with open(path, 'r') as f:
+            statements = split_statements(f.read(), prefix)
+        script = build_migration_script(statements, revision, prefix)
+
+        if dry_run:
+            print(f"\n-- {os.path.basename(path)}")
+            print(script, end='')
+            continue
+
+        start = time.monotonic()
+        result = mysql_exec(docker_cmd, project_dir, db_config, script, force=force)
+        elapsed = time.monotonic() - start
+        if result.returncode != 0 and not force:
+            raise MigrationError(f"Migration {os.path.basename(path)} failed after {elapsed:.2f}s:\n{result.stderr.strip()}\n"
+                                 "Statements before the failing one may already be applied; dbVersion was not updated.\n"
+                                 "Fix the database by hand, or re-run with --migrate-only --force to skip failing "
+                                 "statements (every error is reported) and record the migration as applied.")
+
+        # Like install/index.php, --force only reports failing statements.
+        errors = [line for line in result.stderr.splitlines() if line.startswith('ERROR')]
+        for error in errors:
+            print(f"Skipped failing statement in {os.path.basename(path)}: {error}")
+        if force and get_db_version(docker_cmd, project_dir, db_config) != revision:
+            raise MigrationError(f"Migration {os.path.basename(path)} could not record dbVersion {revision}.")
+        print(f"Applied {os.path.basename(path)} ({len(statements)} statements, {len(errors)} skipped) in {elapsed:.2f}s")
+
+    if pending and not dry_run:
+        print(f"Migrated database to version {pending[-1][0]} in {time.monotonic() - total_start:.2f}s")
+
+def migrate(docker_cmd, project_dir, dry_run=False, force=False):
+    try:
+        db_config = read_db_config(project_dir)
+        if db_config is None:
+            print("No includes/config.php found, skipping migrations (use the /install/ wizard for a new installation).")
+            return True
+
+        if db_config['host'] != DB_SERVICE or db_config.get('port', '') not in ('', '3306'):
+            raise MigrationError(f"includes/config.php points to {db_config['host']}:{db_config.get('port', '')}, "
+                                 f"but migrations can only be applied to the '{DB_SERVICE}' compose service. "
+                                 "Apply them through the /install/ wizard instead.")
+
+        wait_for_database(docker_cmd, project_dir, db_config)
+        run_migrations(docker_cmd, project_dir, db_config, dry_run, force)
+    except MigrationError as e:
+        print(f"Error: {e}")
+        return False
+    return True
+
 def main():
     parser = argparse.ArgumentParser(description="Deploy UltimateXnova on VPS")
     parser.add_argument("--port", type=int, default=3838, help="Host port for the web application (default: 3838)")
+    parser.add_argument("--migrate-only", action="store_true", help="Only apply pending database migrations to the running containers")
+    parser.add_argument("--dry-run", action="store_true", help="Show pending database migrations without applying them (implies --migrate-only)")
+    parser.add_argument("--force", action="store_true", help="Skip failing migration statements, report them and mark the migration as applied")
+    parser.add_argument("--skip-migrations", action="store_true", help="Do not apply database migrations after starting the containers")
     args = parser.parse_args()
 
     project_dir = os.getcwd() # Assumes script is run from project root
+
+    if args.migrate_only or args.dry_run:
+        print(f"Migrating UltimateXnova database from {project_dir}...")
+        docker_cmd = detect_docker_compose()
+        if not migrate(docker_cmd, project_dir, args.dry_run, args.force):
+            exit(1)
+        return
+
     print(f"Deploying UltimateXnova from {project_dir}...")
 
     # 0. Restore Missing Cache Files (GitIgnore Issue)
-    print("\n[0/5] Restoring Missing Core Files...")
+    print("\n[0/6] Restoring Missing Core Files...")
     
     files_to_restore = {
         'includes/classes/cache/builder/BuildCache.interface.php': r'''<?php
@@ -399,7 +590,7 @@ class VarsBuildCache implements BuildCache
 
 
     # 1. Patch GeneralFunctions.php
-    print("\n[1/5] Patching Codebase...")
+    print("\n[1/6] Patching Codebase...")
     gf_path = os.path.join(project_dir, 'includes', 'GeneralFunctions.php')
     
     # Patch 1: Add error_log to exceptionHandler
@@ -442,7 +633,7 @@ class VarsBuildCache implements BuildCache
 
 
     # 2. Configure Docker Compose
-    print("\n[2/5] Configuring Docker...")
+    print("\n[2/6] Configuring Docker...")
     dc_path = os.path.join(project_dir, 'docker-compose.yml')
     with open(dc_path, 'r') as f:
         dc_content = f.read()
@@ -456,7 +647,7 @@ class VarsBuildCache implements BuildCache
 
 
     # 3. Fix Permissions
-    print("\n[3/5] Fixing Permissions...")
+    print("\n[3/6] Fixing Permissions...")
     
     # Ensure cache directory exists
     cache_path = os.path.join(project_dir, 'cache')
@@ -491,27 +682,26 @@ class VarsBuildCache implements BuildCache
 
 
     # 4. Start Docker
-    print("\n[4/5] Starting Docker Containers...")
+    print("\n[4/6] Starting Docker Containers...")
     
     # Detect docker compose command
-    docker_cmd = "docker-compose"
-    try:
-        subprocess.check_call("docker-compose --version", shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    except:
-        try:
-            subprocess.check_call("docker compose version", shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            docker_cmd = "docker compose"
-        except:
-            print("Error: neither 'docker-compose' nor 'docker compose' found. Please install Docker and Docker Compose.")
-            exit(1)
-            
+    docker_cmd = detect_docker_compose()
     print(f"Using command: {docker_cmd}")
     run_command(f"{docker_cmd} down", cwd=project_dir, ignore_errors=True)
     run_command(f"{docker_cmd} up -d --build", cwd=project_dir)
 
 
-    # 5. Output Nginx Config
-    print("\n[5/5] Deployment Complete!")
+    # 5. Apply Database Migrations
+    print("\n[5/6] Applying Database Migrations...")
+    if args.skip_migrations:
+        print("Skipped (--skip-migrations).")
+        migrated = True
+    else:
+        migrated = migrate(docker_cmd, project_dir, force=args.force)
+
+
+    # 6. Output Nginx Config
+    print("\n[6/6] Deployment Complete!")
     print("\n" + "="*50)
     print("Nginx Configuration")
     print("="*50)
@@ -530,5 +720,9 @@ server {{
     print("="*50)
     print("\nTo start installation, visit: http://YOUR_VPS_IP:" + str(args.port) + "/install/")
 
+    if not migrated:
+        print("\nError: Database migrations failed. Fix the error above and re-run with --migrate-only.")
+        exit(1)
+
 if __name__ == "__main__":
     main()
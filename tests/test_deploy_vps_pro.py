@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# Tests for the migration stage of deploy_vps_pro.py.
+#
+#   python -m pytest tests/test_deploy_vps_pro.py
+#
+# MigrationContainerTest starts a disposable mysql:5.7 compose project and is
+# skipped when Docker is not available.
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import uuid
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import deploy_vps_pro as deploy
+
+PREFIX = 'uni1_'
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+def write_config(project_dir, host='db', port='3306', user='uxn_user', password='uxn_password',
+                 database='ultimatexnova', prefix=PREFIX):
+    def php_quote(value):
+        return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+    write_file(os.path.join(project_dir, 'includes', 'config.php'), f"""<?php
+$database					= array();
+$database['host']			= {php_quote(host)};
+$database['port']			= {php_quote(port)};
+$database['user']			= {php_quote(user)};
+$database['userpw']			= {php_quote(password)};
+$database['databasename']	= {php_quote(database)};
+$database['tableprefix']	= {php_quote(prefix)};
+$salt						= 'abcdefghijklmnopqrstuv';
+?>
+""")
+
+class SplitStatementsTest(unittest.TestCase):
+    def test_replaces_prefix_and_splits(self):
+        sql = "ALTER TABLE %PREFIX%config ADD `a` int;\nALTER TABLE `%PREFIX%users` ADD `b` int;"
+        self.assertEqual(deploy.split_statements(sql, PREFIX), [
+            "ALTER TABLE uni1_config ADD `a` int",
+            "ALTER TABLE `uni1_users` ADD `b` int",
+        ])
+
+    def test_keeps_multiline_statements_and_skips_blank_lines(self):
+        sql = "CREATE TABLE `%PREFIX%t` (\n  `a` int\n) ENGINE=MyISAM;\n\n\r\nINSERT INTO %PREFIX%t\nSELECT 1;\n"
+        self.assertEqual(deploy.split_statements(sql, PREFIX), [
+            "CREATE TABLE `uni1_t` (\n  `a` int\n) ENGINE=MyISAM",
+            "INSERT INTO uni1_t\nSELECT 1",
+        ])
+
+    def test_shipped_migrations_split(self):
+        with open(os.path.join(ROOT_DIR, 'install', 'migrations', 'migration_7.sql')) as f:
+            statements = deploy.split_statements(f.read(), PREFIX)
+        self.assertEqual(len(statements), 6)
+        self.assertTrue(statements[1].startswith("INSERT INTO `uni1_trades`"))
+
+class BuildMigrationScriptTest(unittest.TestCase):
+    def test_version_bump_is_last_statement(self):
+        script = deploy.build_migration_script(["ALTER TABLE uni1_a ADD `x` int"], 4, PREFIX)
+        self.assertEqual(script, "ALTER TABLE uni1_a ADD `x` int;\nUPDATE `uni1_system` SET dbVersion = 4;\n")
+
+    def test_does_not_wrap_in_transaction(self):
+        script = deploy.build_migration_script(["UPDATE uni1_vars SET a = 1"], 2, PREFIX)
+        self.assertNotIn("TRANSACTION", script)
+        self.assertNotIn("COMMIT", script)
+
+class ProjectFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.project_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.project_dir)
+
+    def test_list_migrations_sorts_numerically(self):
+        for name in ('migration_10.sql', 'migration_2.sql', 'migration_1.sql', 'migration_3.php', '.htaccess'):
+            write_file(os.path.join(self.project_dir, 'install', 'migrations', name), '')
+        revisions = [revision for revision, path in deploy.list_migrations(self.project_dir)]
+        self.assertEqual(revisions, [1, 2, 10])
+
+    def test_read_db_config_missing_file(self):
+        self.assertIsNone(deploy.read_db_config(self.project_dir))
+
+    def test_read_db_config(self):
+        write_config(self.project_dir)
+        config = deploy.read_db_config(self.project_dir)
+        self.assertEqual(config['host'], 'db')
+        self.assertEqual(config['port'], '3306')
+        self.assertEqual(config['userpw'], 'uxn_password')
+        self.assertEqual(config['tableprefix'], PREFIX)
+
+    def test_read_db_config_unescapes_php_strings(self):
+        write_config(self.project_dir, password="it's a \\secret\\")
+        self.assertEqual(deploy.read_db_config(self.project_dir)['userpw'], "it's a \\secret\\")
+
+    def test_read_db_config_unparseable(self):
+        write_file(os.path.join(self.project_dir, 'includes', 'config.php'),
+                   "<?php\n$database['host'] = \"db\";\n")
+        with self.assertRaises(deploy.MigrationError):
+            deploy.read_db_config(self.project_dir)
+
+    def test_read_required_db_version(self):
+        write_file(os.path.join(self.project_dir, 'includes', 'dbtables.php'),
+                   "<?php\ndefine('DB_VERSION_REQUIRED', 12);\n")
+        self.assertEqual(deploy.read_required_db_version(self.project_dir), 12)
+
+    def test_read_required_db_version_missing(self):
+        write_file(os.path.join(self.project_dir, 'includes', 'dbtables.php'), "<?php\n")
+        with self.assertRaises(deploy.MigrationError):
+            deploy.read_required_db_version(self.project_dir)
+
+    def test_migrate_refuses_foreign_host(self):
+        write_config(self.project_dir, host='10.0.0.5')
+        self.assertFalse(deploy.migrate('docker compose', self.project_dir))
+
+class WaitForDatabaseTest(unittest.TestCase):
+    db_config = {'user': 'uxn_user', 'userpw': 'wrong', 'databasename': 'ultimatexnova'}
+
+    def result(self, returncode, stderr=''):
+        return subprocess.CompletedProcess([], returncode, '', stderr)
+
+    def test_probes_over_tcp(self):
+        with mock.patch.object(deploy, 'mysql_exec', return_value=self.result(0)) as mysql_exec:
+            deploy.wait_for_database('docker compose', ROOT_DIR, self.db_config)
+        self.assertTrue(mysql_exec.call_args.kwargs['tcp'])
+
+    def test_access_denied_fails_immediately(self):
+        denied = self.result(1, "ERROR 1045 (28000): Access denied for user 'uxn_user'@'localhost'")
+        with mock.patch.object(deploy, 'mysql_exec', return_value=denied) as mysql_exec, \
+             mock.patch.object(deploy.time, 'sleep') as sleep:
+            with self.assertRaisesRegex(deploy.MigrationError, 'ERROR 1045'):
+                deploy.wait_for_database('docker compose', ROOT_DIR, self.db_config)
+        self.assertEqual(mysql_exec.call_count, 1)
+        sleep.assert_not_called()
+
+    def test_timeout_reports_last_error(self):
+        refused = self.result(1, "ERROR 2003 (HY000): Can't connect to MySQL server on '127.0.0.1'")
+        with mock.patch.object(deploy, 'mysql_exec', return_value=refused), \
+             mock.patch.object(deploy.time, 'sleep'):
+            with self.assertRaisesRegex(deploy.MigrationError, 'ERROR 2003'):
+                deploy.wait_for_database('docker compose', ROOT_DIR, self.db_config, timeout=0)
+
+def docker_available():
+    if shutil.which('docker') is None:
+        return False
+    return subprocess.run("docker compose version && docker info", shell=True,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+@unittest.skipUnless(docker_available(), "Docker is not available")
+class MigrationContainerTest(unittest.TestCase):
+    # Runs the real migrations against a throwaway mysql:5.7 'db' service,
+    # using the repository's install/ and includes/dbtables.php.
+
+    @classmethod
+    def setUpClass(cls):
+        cls.compose_dir = tempfile.mkdtemp()
+        write_file(os.path.join(cls.compose_dir, 'docker-compose.yml'), """
+services:
+  db:
+    image: mysql:5.7
+    environment:
+      MYSQL_ROOT_PASSWORD: root_password
+      MYSQL_DATABASE: ultimatexnova
+      MYSQL_USER: uxn_user
+      MYSQL_PASSWORD: "it's secret"
+""")
+        cls.docker_cmd = (f"docker compose -p uxn-migrate-test-{uuid.uuid4().hex[:8]} "
+                          f"-f {os.path.join(cls.compose_dir, 'docker-compose.yml')}")
+        subprocess.check_call(f"{cls.docker_cmd} up -d", shell=True)
+
+        cls.project_dir = tempfile.mkdtemp()
+        write_config(cls.project_dir, password="it's secret")
+        cls.db_config = deploy.read_db_config(cls.project_dir)
+
+        # Runs against a freshly initialising volume, which is the case the
+        # TCP probe exists for.
+        deploy.wait_for_database(cls.docker_cmd, ROOT_DIR, cls.db_config, timeout=180)
+
+    @classmethod
+    def tearDownClass(cls):
+        subprocess.call(f"{cls.docker_cmd} down -v", shell=True)
+        shutil.rmtree(cls.compose_dir)
+        shutil.rmtree(cls.project_dir)
+
+    def sql(self, sql):
+        result = deploy.mysql_exec(self.docker_cmd, ROOT_DIR, self.db_config, sql, batch=True)
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout.split()
+
+    def load_install_sql(self, db_version):
+        # Fresh schema from install.sql, rolled back to db_version by dropping
+        # what migration_8 adds.
+        tables = self.sql(f"SHOW TABLES LIKE '{PREFIX}%';")
+        if tables:
+            self.sql("DROP TABLE " + ", ".join(f"`{t}`" for t in tables) + ";")
+
+        with open(os.path.join(ROOT_DIR, 'install', 'install.sql')) as f:
+            install_sql = f.read()
+        for placeholder, value in (('%PREFIX%', PREFIX), ('%VERSION%', '1.8.1.1'), ('%DB_VERSION%', str(db_version))):
+            install_sql = install_sql.replace(placeholder, value)
+        self.sql(install_sql)
+
+    def columns(self, table):
+        return self.sql(f"SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                        f"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = '{PREFIX}{table}';")
+
+    def test_wait_for_database_wrong_password(self):
+        db_config = dict(self.db_config, userpw='wrong')
+        with self.assertRaisesRegex(deploy.MigrationError, 'ERROR 1045'):
+            deploy.wait_for_database(self.docker_cmd, ROOT_DIR, db_config, timeout=10)
+
+    def test_applies_pending_migrations_once(self):
+        self.load_install_sql(7)
+        self.sql(f"ALTER TABLE `{PREFIX}config` DROP `expedition_chances_percent_resources`, "
+                 "DROP `expedition_chances_percent_darkmatter`, DROP `expedition_chances_percent_ships`, "
+                 f"DROP `expedition_chances_percent_pirates`; ALTER TABLE `{PREFIX}users` DROP `bg_img`;")
+        self.assertEqual(deploy.get_db_version(self.docker_cmd, ROOT_DIR, self.db_config), 7)
+
+        deploy.run_migrations(self.docker_cmd, ROOT_DIR, self.db_config)
+        self.assertEqual(deploy.get_db_version(self.docker_cmd, ROOT_DIR, self.db_config), 8)
+        self.assertIn('expedition_chances_percent_pirates', self.columns('config'))
+        self.assertIn('bg_img', self.columns('users'))
+
+        # A second run has nothing left to do.
+        with mock.patch.object(deploy, 'mysql_exec', wraps=deploy.mysql_exec) as mysql_exec:
+            deploy.run_migrations(self.docker_cmd, ROOT_DIR, self.db_config)
+        self.assertEqual([c for c in mysql_exec.call_args_list if 'SET dbVersion' in c.args[4]], [])
+        self.assertEqual(deploy.get_db_version(self.docker_cmd, ROOT_DIR, self.db_config), 8)
+
+    def test_failed_migration_keeps_db_version(self):
+        # install.sql already has migration_8's columns, so re-adding them fails.
+        self.load_install_sql(7)
+        with self.assertRaises(deploy.MigrationError):
+            deploy.run_migrations(self.docker_cmd, ROOT_DIR, self.db_config)
+        self.assertEqual(deploy.get_db_version(self.docker_cmd, ROOT_DIR, self.db_config), 7)
+
+    def test_force_recovers_partially_applied_migration(self):
+        # migration_8 stopped after its first statement: a plain run fails on
+        # the already added column, --force skips it and records version 8.
+        self.load_install_sql(7)
+        self.sql(f"ALTER TABLE `{PREFIX}config` DROP `expedition_chances_percent_darkmatter`, "
+                 "DROP `expedition_chances_percent_ships`, DROP `expedition_chances_percent_pirates`; "
+                 f"ALTER TABLE `{PREFIX}users` DROP `bg_img`;")
+        with self.assertRaises(deploy.MigrationError):
+            deploy.run_migrations(self.docker_cmd, ROOT_DIR, self.db_config)
+
+        deploy.run_migrations(self.docker_cmd, ROOT_DIR, self.db_config, force=True)
+        self.assertEqual(deploy.get_db_version(self.docker_cmd, ROOT_DIR, self.db_config), 8)
+        self.assertIn('expedition_chances_percent_pirates', self.columns('config'))
+        self.assertIn('bg_img', self.columns('users'))
+
+    def test_missing_system_table_is_version_zero(self):
+        self.load_install_sql(8)
+        self.sql(f"DROP TABLE `{PREFIX}system`;")
+        self.assertEqual(deploy.get_db_version(self.docker_cmd, ROOT_DIR, self.db_config), 0)
+
+    def test_empty_system_table_is_an_error(self):
+        self.load_install_sql(8)
+        self.sql(f"DELETE FROM `{PREFIX}system`;")
+        with self.assertRaises(deploy.MigrationError):
+            deploy.get_db_version(self.docker_cmd, ROOT_DIR, self.db_config)
+
+    def test_access_denied_is_an_error(self):
+        db_config = dict(self.db_config, userpw='wrong')
+        with self.assertRaises(deploy.MigrationError):
+            deploy.get_db_version(self.docker_cmd, ROOT_DIR, db_config)
+
+if __name__ == '__main__':
+    unittest.main()